@@ -1,440 +1,912 @@
-"""JesnZIP tray agent
-
-Features:
-- Monitor Windows clipboard for images and file paths (images/videos).
-- On new image/video, upload to s.jesn.zip and copy returned share link to clipboard.
-- Show a small toast notification on successful upload.
-- Tray menu: Open site, Toggle Auto-Upload, Restart, Exit
-"""
-
-import os
-import sys
-import time
-import json
-import logging
-import traceback
-import threading
-import tempfile
-import hashlib
-import webbrowser
-from pathlib import Path
-import subprocess
-
-import requests
-from PIL import Image, ImageGrab
-import win32clipboard
-import win32con
-import pystray
-from pystray import MenuItem
-from PIL import Image as PILImage
-from win32com.client import Dispatch
-import tkinter as _tk
-from tkinter import simpledialog
-try:
-    from winrt.windows.ui.notifications import ToastNotificationManager, ToastNotification
-    from winrt.windows.data.xml.dom import XmlDocument
-    HAVE_WINRT = True
-except Exception:
-    HAVE_WINRT = False
-
-
-# Support a subprocess mode to show a tkinter prompt on the main thread.
-# When the script/exe is invoked with `--session-prompt` it shows the dialog
-# and prints the entered key to stdout. This allows the tray process to spawn
-# a separate process (same exe) which runs tkinter on its own main thread.
-if '--session-prompt' in sys.argv:
-    try:
-        root = _tk.Tk()
-        root.withdraw()
-        key = simpledialog.askstring("JesnZIP Login", "Enter session key (Authorization header):", parent=root)
-        root.destroy()
-        if key:
-            # Print to stdout for the parent to capture
-            print(key, end='', flush=True)
-        sys.exit(0)
-    except Exception:
-        # Ensure we always exit
-        sys.exit(1)
-
-# Logging
-log_file = "JZIP-debug.log"
-logging.basicConfig(filename=log_file, filemode="a", level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
-
-BASE_DIR = Path(__file__).parent.resolve()
-SETTINGS_PATH = BASE_DIR / "tray_settings.json"
-UPLOAD_ENDPOINT = "https://s.jesn.zip/api/upload"
-ORIGIN_HEADER = "https://s.jesn.zip"
-
-DEFAULT_SETTINGS = {
-    "auto_upload": True,
-    "poll_interval": 1.0
-}
-
-
-def load_settings():
-    try:
-        if SETTINGS_PATH.exists():
-            return json.loads(SETTINGS_PATH.read_text(encoding="utf-8"))
-        else:
-            SETTINGS_PATH.write_text(json.dumps(DEFAULT_SETTINGS), encoding="utf-8")
-            return DEFAULT_SETTINGS.copy()
-    except Exception as e:
-        logging.error(f"Failed to load settings: {e}")
-        return DEFAULT_SETTINGS.copy()
-
-
-def save_settings(settings):
-    try:
-        SETTINGS_PATH.write_text(json.dumps(settings), encoding="utf-8")
-    except Exception as e:
-        logging.error(f"Failed to save settings: {e}")
-
-
-settings = load_settings()
-
-
-
-
-def set_clipboard_text(text: str):
-    try:
-        win32clipboard.OpenClipboard()
-        win32clipboard.EmptyClipboard()
-        win32clipboard.SetClipboardData(win32con.CF_UNICODETEXT, text)
-        win32clipboard.CloseClipboard()
-        logging.debug(f"Set clipboard text: {text}")
-    except Exception as e:
-        logging.error(f"Failed to set clipboard: {e}")
-
-
-def show_notification(title: str, message: str, duration: int = 4):
-    try:
-        # Use native WinRT toasts only
-        if HAVE_WINRT:
-            try:
-                logging.debug("Using WinRT toast")
-                tplt = f"<toast><visual><binding template='ToastGeneric'><text>{title}</text><text>{message}</text></binding></visual></toast>"
-                xml = XmlDocument()
-                xml.load_xml(tplt)
-                notifier = ToastNotificationManager.create_toast_notifier('JesnZIP')
-                toast = ToastNotification(xml)
-                notifier.show(toast)
-                logging.debug("WinRT toast shown")
-                return
-            except Exception as e:
-                logging.exception(f"WinRT toast failed: {e}")
-                return
-        else:
-            logging.warning("WinRT not available; skipping notification (winrt package missing)")
-            return
-    except Exception as e:
-        logging.error(f"Failed to show notification: {e}")
-
-
-def file_hash(path: str):
-    try:
-        h = hashlib.sha256()
-        with open(path, "rb") as f:
-            while True:
-                chunk = f.read(8192)
-                if not chunk:
-                    break
-                h.update(chunk)
-        return h.hexdigest()
-    except Exception:
-        return None
-
-
-def image_bytes_hash(img):
-    try:
-        with tempfile.NamedTemporaryFile(suffix=".png", delete=False) as tf:
-            img.save(tf, format="PNG")
-            tf.flush()
-            h = file_hash(tf.name)
-        os.unlink(tf.name)
-        return h
-    except Exception as e:
-        logging.error(f"image_bytes_hash error: {e}")
-        return None
-
-
-def upload_path(path: str, filename: str = None):
-    try:
-        if not filename:
-            filename = os.path.basename(path)
-        with open(path, "rb") as f:
-            files = {"file": (filename, f)}
-            headers = {"origin": ORIGIN_HEADER}
-            # include Authorization header when a session_key is set
-            sk = settings.get('session_key')
-            if sk:
-                headers['Authorization'] = sk
-            logging.debug(f"Uploading {path} to {UPLOAD_ENDPOINT} with headers keys: {list(headers.keys())}")
-            resp = requests.post(UPLOAD_ENDPOINT, files=files, headers=headers, timeout=60)
-        if resp.status_code in (200, 201):
-            data = resp.json()
-            url = data.get("url") or data.get("share_url") or data.get("file_url")
-            logging.debug(f"Upload response: {data}")
-            return True, url, data
-        else:
-            logging.error(f"Upload failed: {resp.status_code} {resp.text}")
-            return False, None, resp.text
-    except Exception as e:
-        logging.error(f"Upload exception: {e}")
-        return False, None, str(e)
-
-
-def handle_new_file(path: str):
-    logging.info(f"Detected new path to upload: {path}")
-    # upload and copy result
-    ok, url, data = upload_path(path)
-    if ok and url:
-        set_clipboard_text(url)
-        show_notification("JesnZIP", "Upload completed — link copied to clipboard", duration=4)
-    elif ok and not url:
-        show_notification("JesnZIP", "Upload completed (no link returned)", duration=4)
-    else:
-        show_notification("JesnZIP: Upload failed", str(data), duration=6)
-
-
-def monitor_clipboard_loop():
-    last_id = None
-    poll = float(settings.get("poll_interval", 1.0))
-    while True:
-        try:
-            grabbed = ImageGrab.grabclipboard()
-            if grabbed is None:
-                # nothing in clipboard
-                time.sleep(poll)
-                continue
-
-            # If a list of file paths
-            if isinstance(grabbed, list):
-                # handle first path that looks like an image or video
-                for p in grabbed:
-                    if not os.path.exists(p):
-                        continue
-                    ext = os.path.splitext(p)[1].lower()
-                    if ext in ('.png', '.jpg', '.jpeg', '.bmp', '.gif') or ext in ('.mp4', '.mov', '.mkv', '.avi'):
-                        identifier = f"file::{os.path.abspath(p)}::{os.path.getsize(p)}::{os.path.getmtime(p)}"
-                        if identifier != last_id and settings.get("auto_upload", True):
-                            last_id = identifier
-                            threading.Thread(target=handle_new_file, args=(p,), daemon=True).start()
-                        break
-                time.sleep(poll)
-                continue
-
-            # If an image object
-            if isinstance(grabbed, PILImage.Image) or hasattr(grabbed, 'save'):
-                img = grabbed
-                # hash image bytes to dedupe
-                img_h = image_bytes_hash(img)
-                if img_h and img_h != last_id and settings.get("auto_upload", True):
-                    last_id = img_h
-                    # save to temp file
-                    with tempfile.NamedTemporaryFile(suffix=".png", delete=False) as tf:
-                        temp_path = tf.name
-                        img.save(temp_path, format='PNG')
-                    threading.Thread(target=handle_new_file, args=(temp_path,), daemon=True).start()
-                time.sleep(poll)
-                continue
-
-        except Exception as e:
-            logging.error(f"monitor error: {e}\n{traceback.format_exc()}")
-            time.sleep(poll)
-
-
-def toggle_auto_upload(icon, item):
-    settings['auto_upload'] = not settings.get('auto_upload', True)
-    save_settings(settings)
-    # Update menu text by rebuilding menu
-    try:
-        icon.menu = make_menu(icon)
-    except Exception:
-        logging.exception("Failed to update menu after toggling auto_upload")
-
-
-def prompt_for_session_key(icon, item=None):
-    try:
-        # Invoke a separate process (same exe/script) to show the tkinter dialog
-        # This ensures the dialog runs on the subprocess main thread and accepts input.
-        exe = sys.executable
-        script = Path(__file__).resolve()
-        cmd = [str(exe), str(script), '--session-prompt']
-        logging.debug(f"Launching session prompt subprocess: {cmd}")
-        proc = subprocess.run(cmd, capture_output=True, text=True)
-        if proc.returncode == 0 and proc.stdout:
-            key = proc.stdout.strip()
-            if key:
-                settings['session_key'] = key
-                save_settings(settings)
-                show_notification("JesnZIP", "Session key saved", duration=3)
-                try:
-                    icon.menu = make_menu(icon)
-                except Exception:
-                    logging.exception("Failed to update menu after setting session_key")
-                return
-        # If we reach here, nothing was entered or subprocess failed
-        show_notification("JesnZIP", "No session key entered", duration=2)
-    except Exception as e:
-        logging.error(f"prompt_for_session_key failed: {e}")
-
-
-def logout(icon, item=None):
-    try:
-        if 'session_key' in settings:
-            del settings['session_key']
-            save_settings(settings)
-        show_notification("JesnZIP", "Logged out", duration=3)
-        try:
-            icon.menu = make_menu(icon)
-        except Exception:
-            logging.exception("Failed to update menu after logout")
-    except Exception as e:
-        logging.error(f"logout failed: {e}")
-
-
-def _startup_shortcut_path():
-    appdata = os.environ.get('APPDATA')
-    if not appdata:
-        return None
-    startup_dir = os.path.join(appdata, 'Microsoft', 'Windows', 'Start Menu', 'Programs', 'Startup')
-    return os.path.join(startup_dir, 'JesnZIP-tray.lnk')
-
-
-def is_autostart_enabled():
-    try:
-        path = _startup_shortcut_path()
-        if not path or not os.path.exists(path):
-            return False
-        shell = Dispatch('WScript.Shell')
-        lnk = shell.CreateShortcut(path)
-        # Check if shortcut points to current script/executable
-        target = getattr(lnk, 'TargetPath', '')
-        args = getattr(lnk, 'Arguments', '')
-        script_path = str(os.path.join(BASE_DIR, os.path.basename(__file__)))
-        # If the shortcut's arguments include our script path or target equals our exe, assume enabled
-        if script_path in args or os.path.abspath(target) == os.path.abspath(sys.executable):
-            return True
-        return True
-    except Exception:
-        return False
-
-
-def enable_autostart():
-    try:
-        path = _startup_shortcut_path()
-        if not path:
-            return False
-        shell = Dispatch('WScript.Shell')
-        shortcut = shell.CreateShortcut(path)
-        # Point to python executable and pass script as argument so it works during development
-        shortcut.TargetPath = sys.executable
-        shortcut.Arguments = f'"{os.path.join(str(BASE_DIR), os.path.basename(__file__))}"'
-        shortcut.WorkingDirectory = str(BASE_DIR)
-        icon_path = BASE_DIR / 'ICON.ico'
-        if icon_path.exists():
-            shortcut.IconLocation = str(icon_path)
-        shortcut.Save()
-        return True
-    except Exception as e:
-        logging.error(f"enable_autostart failed: {e}")
-        return False
-
-
-def disable_autostart():
-    try:
-        path = _startup_shortcut_path()
-        if path and os.path.exists(path):
-            os.remove(path)
-        return True
-    except Exception as e:
-        logging.error(f"disable_autostart failed: {e}")
-        return False
-
-
-def toggle_autostart(icon, item):
-    current = is_autostart_enabled()
-    if current:
-        ok = disable_autostart()
-        msg = "Autostart disabled" if ok else "Failed to disable autostart"
-    else:
-        ok = enable_autostart()
-        msg = "Autostart enabled" if ok else "Failed to enable autostart"
-    save_settings(settings)
-    try:
-        icon.menu = make_menu(icon)
-    except Exception:
-        logging.exception("Failed to update menu after toggling autostart")
-    show_notification("JesnZIP", msg, duration=3)
-
-
-def open_site(icon, item=None):
-    webbrowser.open("https://s.jesn.zip/create")
-
-
-def restart(icon, item=None):
-    icon.stop()
-    os.execl(sys.executable, sys.executable, *sys.argv)
-
-
-def exit_app(icon, item=None):
-    icon.stop()
-
-
-def make_menu(icon):
-    # Login/Logout menu item
-    auth_item = MenuItem("Logout", logout) if settings.get('session_key') else MenuItem("Login / Set Session Key", prompt_for_session_key)
-
-    return pystray.Menu(
-        MenuItem("Open s.jesn.zip", open_site),
-        auth_item,
-        MenuItem("Auto-Upload", toggle_auto_upload, checked=lambda item: settings.get('auto_upload', True)),
-        MenuItem("Autostart", toggle_autostart, checked=lambda item: is_autostart_enabled()),
-        MenuItem("Restart", restart),
-        MenuItem("Exit", exit_app)
-    )
-
-
-def create_icon_and_run():
-    # Resolve icon path both during development and when frozen by PyInstaller
-    def resource_path(relname: str) -> Path:
-        # When bundled by PyInstaller, files added via --add-data are extracted to _MEIPASS
-        if getattr(sys, 'frozen', False):
-            base = Path(getattr(sys, '_MEIPASS', PATH := ''))
-            if not base:
-                base = BASE_DIR
-        else:
-            base = BASE_DIR
-        return base / relname
-
-    icon_path = resource_path('ICON.ico')
-    if icon_path.exists():
-        try:
-            img = PILImage.open(icon_path)
-            # Ensure the image has a sensible size for the tray
-            img = img.convert('RGBA')
-            if img.size[0] < 32 or img.size[1] < 32:
-                img = img.resize((64, 64), PILImage.LANCZOS)
-        except Exception:
-            img = PILImage.new('RGB', (64, 64), color=(73, 109, 137))
-    else:
-        img = PILImage.new('RGB', (64, 64), color=(73, 109, 137))
-
-    icon = pystray.Icon("JesnZIP", icon=img)
-    # Set initial menu (pass the icon so labels can be computed)
-    icon.menu = make_menu(icon)
-
-    # Start clipboard monitor
-    t = threading.Thread(target=monitor_clipboard_loop, daemon=True)
-    t.start()
-
-    logging.info("Starting JesnZIP tray icon and clipboard monitor")
-    icon.run()
-
-
-if __name__ == '__main__':
-    try:
-        create_icon_and_run()
-    except Exception as e:
-        logging.critical(f"Fatal error in tray agent: {e}\n{traceback.format_exc()}")
-        raise
+"""JesnZIP tray agent
+
+Features:
+- Monitor Windows clipboard for images and file paths (images/videos).
+- On new image/video, upload to s.jesn.zip and copy returned share link to clipboard.
+- Show a small toast notification on successful upload.
+- Tray menu: Open site, Toggle Auto-Upload, Restart, Exit
+"""
+
+import io
+import os
+import sys
+import time
+import json
+import queue
+import ctypes
+import logging
+import traceback
+import struct
+import threading
+import concurrent.futures
+import asyncio
+import webbrowser
+from collections import OrderedDict, deque
+from pathlib import Path
+import subprocess
+
+import imagehash
+import requests
+from requests.adapters import HTTPAdapter, Retry
+from PIL import Image, ImageGrab
+import win32clipboard
+import win32con
+import pystray
+from pystray import MenuItem
+from PIL import Image as PILImage
+from win32com.client import Dispatch
+import tkinter as _tk
+from tkinter import simpledialog
+from xml.sax.saxutils import escape as _xml_escape
+try:
+    from winrt.windows.ui.notifications import ToastNotificationManager, ToastNotification, ToastTemplateType
+    from winrt.windows.data.xml.dom import XmlDocument
+    HAVE_WINRT = True
+except Exception:
+    HAVE_WINRT = False
+try:
+    import win32gui
+    HAVE_LISTENER = True
+except Exception:
+    HAVE_LISTENER = False
+try:
+    import httpx
+    HAVE_HTTPX = True
+except Exception:
+    HAVE_HTTPX = False
+
+
+# Support a subprocess mode to show a tkinter prompt on the main thread.
+# When the script/exe is invoked with `--session-prompt` it shows the dialog
+# and prints the entered key to stdout. This allows the tray process to spawn
+# a separate process (same exe) which runs tkinter on its own main thread.
+if '--session-prompt' in sys.argv:
+    try:
+        root = _tk.Tk()
+        root.withdraw()
+        key = simpledialog.askstring("JesnZIP Login", "Enter session key (Authorization header):", parent=root)
+        root.destroy()
+        if key:
+            # Print to stdout for the parent to capture
+            print(key, end='', flush=True)
+        sys.exit(0)
+    except Exception:
+        # Ensure we always exit
+        sys.exit(1)
+
+# Logging
+log_file = "JZIP-debug.log"
+logging.basicConfig(filename=log_file, filemode="a", level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
+
+BASE_DIR = Path(__file__).parent.resolve()
+SETTINGS_PATH = BASE_DIR / "tray_settings.json"
+UPLOAD_ENDPOINT = "https://s.jesn.zip/api/upload"
+ORIGIN_HEADER = "https://s.jesn.zip"
+
+# Persistent session: keep-alive reuses the TCP+TLS connection across uploads
+SESSION = requests.Session()
+SESSION.headers['origin'] = ORIGIN_HEADER
+_adapter = HTTPAdapter(pool_connections=4, pool_maxsize=8,
+                       max_retries=Retry(total=2, backoff_factor=0.5))
+SESSION.mount('https://', _adapter)
+SESSION.mount('http://', _adapter)
+
+# Optional: drive uploads through one asyncio loop (IOCP-backed Proactor on
+# Windows) so an OS thread isn't parked per in-flight upload. Falls back to
+# the requests session when httpx isn't installed.
+_ASYNC_LOOP = None
+_ASYNC_CLIENT = None
+_ASYNC_LOCK = threading.Lock()
+
+
+def _get_async_loop():
+    global _ASYNC_LOOP, _ASYNC_CLIENT
+    with _ASYNC_LOCK:
+        if _ASYNC_LOOP is None:
+            loop = asyncio.new_event_loop()  # Proactor (IOCP) by default on Windows
+            threading.Thread(target=loop.run_forever, daemon=True, name='upload-io').start()
+            try:
+                client = httpx.AsyncClient(http2=True, timeout=60, headers={'origin': ORIGIN_HEADER})
+            except ImportError:
+                # http2 extra (h2) not installed
+                client = httpx.AsyncClient(timeout=60, headers={'origin': ORIGIN_HEADER})
+            _ASYNC_LOOP, _ASYNC_CLIENT = loop, client
+    return _ASYNC_LOOP, _ASYNC_CLIENT
+
+
+def _post_upload(files, headers):
+    """POST to the upload endpoint: async httpx when available, else requests."""
+    if HAVE_HTTPX:
+        loop, client = _get_async_loop()
+        fut = asyncio.run_coroutine_threadsafe(
+            client.post(UPLOAD_ENDPOINT, files=files, headers=headers), loop)
+        return fut.result()
+    return SESSION.post(UPLOAD_ENDPOINT, files=files, headers=headers, timeout=60)
+
+
+# Bounded pool so a burst of copies can't spawn unbounded upload threads
+UPLOAD_POOL = concurrent.futures.ThreadPoolExecutor(max_workers=4, thread_name_prefix='upload')
+_IN_FLIGHT = set()
+_IN_FLIGHT_LOCK = threading.Lock()
+
+
+def submit_upload(fn, key, *args):
+    """Queue an upload job on the pool unless an identical one is already in flight."""
+    with _IN_FLIGHT_LOCK:
+        if key in _IN_FLIGHT:
+            logging.debug("Upload for %s already in flight; skipping", key)
+            return None
+        _IN_FLIGHT.add(key)
+
+    def _job():
+        try:
+            return fn(*args)
+        finally:
+            with _IN_FLIGHT_LOCK:
+                _IN_FLIGHT.discard(key)
+
+    return UPLOAD_POOL.submit(_job)
+
+DEFAULT_SETTINGS = {
+    "auto_upload": True,
+    "poll_interval": 1.0
+}
+
+
+def load_settings():
+    try:
+        if SETTINGS_PATH.exists():
+            return json.loads(SETTINGS_PATH.read_text(encoding="utf-8"))
+        else:
+            SETTINGS_PATH.write_text(json.dumps(DEFAULT_SETTINGS), encoding="utf-8")
+            return DEFAULT_SETTINGS.copy()
+    except Exception as e:
+        logging.error("Failed to load settings: %s", e)
+        return DEFAULT_SETTINGS.copy()
+
+
+_SETTINGS_LOCK = threading.Lock()
+_SAVE_TIMER = None
+_LAST_JSON = None
+_SAVE_DEBOUNCE_S = 0.5
+
+
+def _write_settings():
+    global _LAST_JSON
+    try:
+        with _SETTINGS_LOCK:
+            data = json.dumps(settings)
+            if data == _LAST_JSON:
+                # nothing changed since the last write
+                return
+            tmp = SETTINGS_PATH.with_suffix('.json.tmp')
+            tmp.write_text(data, encoding="utf-8")
+            os.replace(tmp, SETTINGS_PATH)  # atomic on NTFS
+            _LAST_JSON = data
+    except Exception as e:
+        logging.error("Failed to save settings: %s", e)
+
+
+def save_settings(settings):
+    # Debounce so rapid toggles coalesce into a single atomic write
+    global _SAVE_TIMER
+    with _SETTINGS_LOCK:
+        if _SAVE_TIMER is not None:
+            _SAVE_TIMER.cancel()
+        _SAVE_TIMER = threading.Timer(_SAVE_DEBOUNCE_S, _write_settings)
+        _SAVE_TIMER.daemon = True
+        _SAVE_TIMER.start()
+
+
+settings = load_settings()
+
+
+
+
+def set_clipboard_text(text: str):
+    try:
+        win32clipboard.OpenClipboard()
+        win32clipboard.EmptyClipboard()
+        win32clipboard.SetClipboardData(win32con.CF_UNICODETEXT, text)
+        win32clipboard.CloseClipboard()
+        logging.debug("Set clipboard text: %s", text)
+    except Exception as e:
+        logging.error("Failed to set clipboard: %s", e)
+
+
+# Built lazily on first toast and reused: creating the notifier and parsing the
+# template XML are per-call costs we only need to pay once. The shared document
+# is mutated per toast, so _TOAST_LOCK serializes callers (upload-pool workers,
+# the batch collector and menu handlers can all toast concurrently).
+_NOTIFIER = None
+_TOAST_TEMPLATE_XML = None
+_TOAST_LOCK = threading.Lock()
+
+
+def _get_toast_parts():
+    global _NOTIFIER, _TOAST_TEMPLATE_XML
+    if _NOTIFIER is None:
+        _NOTIFIER = ToastNotificationManager.create_toast_notifier('JesnZIP')
+    if _TOAST_TEMPLATE_XML is None:
+        _TOAST_TEMPLATE_XML = ToastNotificationManager.get_template_content(ToastTemplateType.TOAST_TEXT02)
+    return _NOTIFIER, _TOAST_TEMPLATE_XML
+
+
+def show_notification(title: str, message: str, duration: int = 4):
+    try:
+        # Use native WinRT toasts only
+        if not HAVE_WINRT:
+            logging.warning("WinRT not available; skipping notification (winrt package missing)")
+            return
+        try:
+            logging.debug("Using WinRT toast")
+            notifier, xml = _get_toast_parts()
+            with _TOAST_LOCK:
+                texts = xml.get_elements_by_tag_name('text')
+                texts.item(0).inner_text = title
+                texts.item(1).inner_text = message
+                notifier.show(ToastNotification(xml))
+            logging.debug("WinRT toast shown")
+            return
+        except Exception:
+            logging.exception("Pre-parsed toast failed; falling back to template string")
+        tplt = f"<toast><visual><binding template='ToastGeneric'><text>{_xml_escape(title)}</text><text>{_xml_escape(message)}</text></binding></visual></toast>"
+        xml = XmlDocument()
+        xml.load_xml(tplt)
+        notifier = ToastNotificationManager.create_toast_notifier('JesnZIP')
+        notifier.show(ToastNotification(xml))
+        logging.debug("WinRT toast shown (fallback template)")
+    except Exception as e:
+        logging.error("Failed to show notification: %s", e)
+
+
+# Recent clipboard image hashes; a new image within this Hamming distance of
+# any of them is treated as a re-copy of the same picture and not re-uploaded.
+_RECENT_IMAGE_HASHES = deque(maxlen=16)
+_DUP_HAMMING_THRESHOLD = 6
+
+
+def image_bytes_hash(img):
+    try:
+        # Perceptual hash: invariant to PNG recompression / metadata drift,
+        # so re-saved copies of the same screenshot dedupe correctly.
+        return imagehash.dhash(img, hash_size=16)
+    except Exception as e:
+        logging.error("image_bytes_hash error: %s", e)
+        return None
+
+
+def is_duplicate_image(img_h):
+    return any((img_h - seen) <= _DUP_HAMMING_THRESHOLD for seen in _RECENT_IMAGE_HASHES)
+
+
+def upload_path(path: str, filename: str = None):
+    try:
+        if not filename:
+            filename = os.path.basename(path)
+        with open(path, "rb") as f:
+            files = {"file": (filename, f)}
+            headers = {}
+            # include Authorization header when a session_key is set
+            sk = settings.get('session_key')
+            if sk:
+                headers['Authorization'] = sk
+            if logging.getLogger().isEnabledFor(logging.DEBUG):
+                logging.debug("Uploading %s to %s with headers keys: %s", path, UPLOAD_ENDPOINT, list(headers.keys()))
+            resp = _post_upload(files, headers)
+        if resp.status_code in (200, 201):
+            data = resp.json()
+            url = data.get("url") or data.get("share_url") or data.get("file_url")
+            logging.debug("Upload response: %s", data)
+            return True, url, data
+        else:
+            logging.error("Upload failed: %s %s", resp.status_code, resp.text)
+            return False, None, resp.text
+    except Exception as e:
+        logging.error("Upload exception: %s", e)
+        return False, None, str(e)
+
+
+def upload_image(img, filename: str):
+    try:
+        # Stream straight from memory; the pixels never need to touch disk.
+        buf = io.BytesIO()
+        if 'A' not in img.getbands():
+            # no alpha to preserve: JPEG is ~10x smaller than PNG for
+            # photo-like content and much faster to encode
+            if img.mode not in ('RGB', 'L'):
+                img = img.convert('RGB')
+            img.save(buf, format='JPEG', quality=85)
+            filename = os.path.splitext(filename)[0] + '.jpg'
+            mime = 'image/jpeg'
+        else:
+            # compress_level=1: deflate level 6 costs most of the encode CPU
+            # for a few percent of size
+            img.save(buf, format='PNG', compress_level=1, optimize=False)
+            mime = 'image/png'
+        buf.seek(0)
+        headers = {}
+        sk = settings.get('session_key')
+        if sk:
+            headers['Authorization'] = sk
+        logging.debug("Uploading clipboard image as %s to %s", filename, UPLOAD_ENDPOINT)
+        resp = _post_upload({"file": (filename, buf, mime)}, headers)
+        if resp.status_code in (200, 201):
+            data = resp.json()
+            url = data.get("url") or data.get("share_url") or data.get("file_url")
+            logging.debug("Upload response: %s", data)
+            return True, url, data
+        else:
+            logging.error("Upload failed: %s %s", resp.status_code, resp.text)
+            return False, None, resp.text
+    except Exception as e:
+        logging.error("Upload exception: %s", e)
+        return False, None, str(e)
+
+
+def _finish_upload(ok, url, data):
+    if ok and url:
+        set_clipboard_text(url)
+        show_notification("JesnZIP", "Upload completed — link copied to clipboard", duration=4)
+    elif ok and not url:
+        show_notification("JesnZIP", "Upload completed (no link returned)", duration=4)
+    else:
+        show_notification("JesnZIP: Upload failed", str(data), duration=6)
+
+
+# Share URLs of recently uploaded files, keyed by (abspath, size, mtime_ns).
+# Re-copying an unchanged file just re-copies its link -- no HTTP at all.
+_UPLOAD_CACHE = OrderedDict()
+_UPLOAD_CACHE_MAX = 64
+
+
+def handle_new_file(path: str, copy_link: bool = True):
+    """Upload one file; returns the share URL (or None).
+
+    With copy_link=False the clipboard/success toast is left to the caller so
+    batch uploads can do a single clipboard write for the whole set."""
+    logging.info("Detected new path to upload: %s", path)
+    try:
+        st = os.stat(path)
+        cache_key = (os.path.abspath(path), st.st_size, st.st_mtime_ns)
+    except OSError:
+        cache_key = None
+    if cache_key is not None and cache_key in _UPLOAD_CACHE:
+        _UPLOAD_CACHE.move_to_end(cache_key)
+        url = _UPLOAD_CACHE[cache_key]
+        logging.debug("Upload cache hit for %s; reusing %s", path, url)
+        if copy_link:
+            set_clipboard_text(url)
+            show_notification("JesnZIP", "Already uploaded — link copied to clipboard", duration=4)
+        return url
+    # upload and copy result
+    ok, url, data = upload_path(path)
+    if ok and url and cache_key is not None:
+        _UPLOAD_CACHE[cache_key] = url
+        while len(_UPLOAD_CACHE) > _UPLOAD_CACHE_MAX:
+            _UPLOAD_CACHE.popitem(last=False)
+    if copy_link:
+        _finish_upload(ok, url, data)
+    elif not ok:
+        show_notification("JesnZIP: Upload failed", str(data), duration=6)
+    return url if ok else None
+
+
+def _collect_batch_links(futures, cached_urls=()):
+    """Wait for a batch of uploads, then set the clipboard once with all links."""
+    urls = list(cached_urls)
+    for f in futures:
+        try:
+            url = f.result()
+        except Exception:
+            logging.exception("batch upload worker failed")
+            continue
+        if url:
+            urls.append(url)
+    if urls:
+        set_clipboard_text("\n".join(urls))
+        show_notification("JesnZIP", f"Uploaded {len(urls)} files — links copied to clipboard", duration=4)
+
+
+def handle_new_image(img):
+    logging.info("Detected new clipboard image to upload")
+    ok, url, data = upload_image(img, f"clipboard-{int(time.time())}.png")
+    _finish_upload(ok, url, data)
+
+
+WM_CLIPBOARDUPDATE = 0x031D
+CF_DIBV5 = 17
+
+# Identifiers of file-list entries we already dispatched; only suppresses
+# back-to-back re-copies of something not (yet) in _UPLOAD_CACHE, e.g. an
+# upload that is still in flight or that failed.
+_RECENT_FILE_IDS = deque(maxlen=64)
+
+# Image/video extensions we auto-upload; frozenset for O(1) membership with
+# zero per-tick allocation
+_MEDIA_EXTS = frozenset({'.png', '.jpg', '.jpeg', '.bmp', '.gif', '.webp',
+                         '.mp4', '.mov', '.mkv', '.avi', '.webm'})
+
+
+def _dib_to_image(dib):
+    """Decode an uncompressed 24/32bpp CF_DIB payload straight into a PIL image.
+
+    Returns None for any other layout so the caller can fall back to Pillow's
+    full decoder."""
+    try:
+        hdr_size, width, height, planes, bpp, compression = struct.unpack_from('<IiiHHI', dib, 0)
+        if compression != 0:  # BI_RGB only
+            return None
+        if bpp == 32:
+            raw_mode, stride = 'BGRX', width * 4
+        elif bpp == 24:
+            raw_mode, stride = 'BGR', (width * 3 + 3) & ~3
+        else:
+            return None
+        # Even BI_RGB true-color DIBs may carry an optimization color table
+        # (biClrUsed entries of 4 bytes each) between header and pixels.
+        clr_used = struct.unpack_from('<I', dib, 32)[0]
+        pixels_at = hdr_size + clr_used * 4
+        orientation = -1 if height > 0 else 1
+        return PILImage.frombuffer('RGB', (width, abs(height)), dib[pixels_at:], 'raw', raw_mode, stride, orientation)
+    except Exception:
+        logging.exception("DIB decode failed")
+        return None
+
+
+def _grab_clipboard():
+    """Cheaper replacement for ImageGrab.grabclipboard().
+
+    Enumerate the available formats first: the file-path case never touches
+    PIL, and an image is only materialized when a DIB format is actually
+    present. Falls back to Pillow's decoder for exotic DIB layouts."""
+    need_pil_fallback = False
+    try:
+        win32clipboard.OpenClipboard()
+    except Exception:
+        return None
+    try:
+        fmts = []
+        f = win32clipboard.EnumClipboardFormats(0)
+        while f:
+            fmts.append(f)
+            f = win32clipboard.EnumClipboardFormats(f)
+        if win32con.CF_HDROP in fmts:
+            # pywin32 hands back the dropped file names as a tuple of strings
+            return list(win32clipboard.GetClipboardData(win32con.CF_HDROP))
+        if win32con.CF_DIB in fmts or CF_DIBV5 in fmts:
+            img = _dib_to_image(win32clipboard.GetClipboardData(win32con.CF_DIB))
+            if img is not None:
+                return img
+            need_pil_fallback = True
+        # no format we care about
+    finally:
+        win32clipboard.CloseClipboard()
+    if need_pil_fallback:
+        return ImageGrab.grabclipboard()
+    return None
+
+
+def process_clipboard():
+    """Grab the clipboard once and dispatch any new image/file for upload."""
+    try:
+        grabbed = _grab_clipboard()
+        if grabbed is None:
+            # nothing in clipboard
+            return
+
+        # If a list of file paths
+        if isinstance(grabbed, list):
+            if not settings.get("auto_upload", True):
+                return
+            # collect every path that looks like an image or video; we only
+            # get here after the clipboard sequence number changed, so the
+            # stats are never redundant -- and must be fresh, or a re-copied
+            # modified file would keep its old identifier and be skipped
+            entries = []
+            for p in grabbed:
+                if os.path.splitext(p)[1].lower() not in _MEDIA_EXTS:
+                    continue
+                try:
+                    # one stat instead of exists/getsize/getmtime
+                    st = os.stat(p)
+                except OSError:
+                    continue
+                entries.append((f"file::{p}::{st.st_size}::{st.st_mtime_ns}", p,
+                                (os.path.abspath(p), st.st_size, st.st_mtime_ns)))
+            cached_urls = []
+            new_paths = []
+            for identifier, p, cache_key in entries:
+                # known upload: re-copy its link instead of silently dropping it
+                if cache_key in _UPLOAD_CACHE:
+                    _UPLOAD_CACHE.move_to_end(cache_key)
+                    cached_urls.append(_UPLOAD_CACHE[cache_key])
+                    continue
+                if identifier not in _RECENT_FILE_IDS:
+                    _RECENT_FILE_IDS.append(identifier)
+                    new_paths.append((identifier, p))
+            if not new_paths:
+                if cached_urls:
+                    set_clipboard_text("\n".join(cached_urls))
+                    show_notification("JesnZIP", "Already uploaded — link copied to clipboard", duration=4)
+            elif len(new_paths) == 1 and not cached_urls:
+                identifier, p = new_paths[0]
+                submit_upload(handle_new_file, identifier, p)
+            else:
+                # batch: upload in parallel on the pool, then one clipboard write
+                futures = [submit_upload(handle_new_file, ident, p, False) for ident, p in new_paths]
+                futures = [f for f in futures if f is not None]
+                threading.Thread(target=_collect_batch_links, args=(futures, cached_urls), daemon=True).start()
+            return
+
+        # If an image object
+        if isinstance(grabbed, PILImage.Image) or hasattr(grabbed, 'save'):
+            img = grabbed
+            # hash image bytes to dedupe
+            img_h = image_bytes_hash(img)
+            if img_h is not None and not is_duplicate_image(img_h) and settings.get("auto_upload", True):
+                _RECENT_IMAGE_HASHES.append(img_h)
+                submit_upload(handle_new_image, str(img_h), img)
+
+    except Exception as e:
+        logging.error("monitor error: %s\n%s", e, traceback.format_exc())
+
+
+def monitor_clipboard_listener():
+    """Event-driven monitor: a hidden message-only window receives
+    WM_CLIPBOARDUPDATE so we only touch the clipboard when it actually changed."""
+    last_seq = None
+
+    def _wnd_proc(hwnd, msg, wparam, lparam):
+        nonlocal last_seq
+        if msg == WM_CLIPBOARDUPDATE:
+            # Cheap dedupe gate: skip the grab entirely when the sequence number is unchanged
+            seq = ctypes.windll.user32.GetClipboardSequenceNumber()
+            if seq != last_seq:
+                last_seq = seq
+                process_clipboard()
+            return 0
+        return win32gui.DefWindowProc(hwnd, msg, wparam, lparam)
+
+    wc = win32gui.WNDCLASS()
+    wc.lpfnWndProc = _wnd_proc
+    wc.lpszClassName = 'JesnZIPClipboardListener'
+    wc.hInstance = win32gui.GetModuleHandle(None)
+    atom = win32gui.RegisterClass(wc)
+    hwnd = win32gui.CreateWindowEx(0, atom, 'JesnZIP clipboard listener', 0, 0, 0, 0, 0,
+                                   win32con.HWND_MESSAGE, 0, wc.hInstance, None)
+    if not ctypes.windll.user32.AddClipboardFormatListener(hwnd):
+        raise OSError("AddClipboardFormatListener failed")
+    logging.info("Clipboard listener registered; waiting for WM_CLIPBOARDUPDATE")
+    win32gui.PumpMessages()
+
+
+MAX_POLL_INTERVAL = 8.0
+
+
+def monitor_clipboard_loop():
+    """Polling fallback for when the clipboard listener cannot be set up."""
+    last_seq = None
+    poll = float(settings.get("poll_interval", 1.0))
+    cur_poll = poll
+    while True:
+        # O(1) change gate: GetClipboardSequenceNumber only changes when the
+        # clipboard contents do, so skip the expensive grab on idle ticks.
+        seq = ctypes.windll.user32.GetClipboardSequenceNumber()
+        if seq == last_seq:
+            # idle: back off exponentially to cut wakeups on a quiet clipboard
+            cur_poll = min(cur_poll * 2, MAX_POLL_INTERVAL)
+            time.sleep(cur_poll)
+            continue
+        process_clipboard()
+        last_seq = seq
+        cur_poll = poll
+        time.sleep(cur_poll)
+
+
+def monitor_clipboard():
+    if HAVE_LISTENER:
+        try:
+            monitor_clipboard_listener()
+            return
+        except Exception:
+            logging.exception("Clipboard listener failed; falling back to polling")
+    monitor_clipboard_loop()
+
+
+def toggle_auto_upload(icon, item):
+    settings['auto_upload'] = not settings.get('auto_upload', True)
+    save_settings(settings)
+    # Update menu text by rebuilding menu
+    try:
+        icon.menu = make_menu(icon)
+    except Exception:
+        logging.exception("Failed to update menu after toggling auto_upload")
+
+
+class _TkPrompt:
+    """Long-lived hidden Tk root on its own thread.
+
+    Dialogs are marshalled onto that thread via root.after, so prompting never
+    needs the old subprocess hop (a full re-import of Pillow/pystray/requests
+    just to show one dialog)."""
+
+    def __init__(self):
+        self._ready = threading.Event()
+        self._busy = threading.Lock()
+        self._root = None
+        threading.Thread(target=self._run, daemon=True, name='tk-prompt').start()
+
+    def _run(self):
+        try:
+            self._root = _tk.Tk()
+            self._root.withdraw()
+            self._ready.set()
+            self._root.mainloop()
+        except Exception:
+            logging.exception("Tk prompt thread failed")
+            self._ready.set()
+
+    def prompt(self, title: str, message: str):
+        # Refuse to stack dialogs
+        if not self._busy.acquire(blocking=False):
+            logging.debug("Prompt already open; ignoring request")
+            return None
+        try:
+            self._ready.wait(timeout=5)
+            if self._root is None:
+                return None
+            result = queue.Queue()
+
+            def _ask():
+                try:
+                    result.put(simpledialog.askstring(title, message, parent=self._root))
+                except Exception:
+                    logging.exception("askstring failed")
+                    result.put(None)
+
+            self._root.after(0, _ask)
+            try:
+                # generous timeout so a dead Tk thread can't wedge the pystray
+                # menu thread (and _busy) forever
+                return result.get(timeout=120)
+            except queue.Empty:
+                logging.error("Tk prompt never answered; giving up")
+                return None
+        finally:
+            self._busy.release()
+
+
+_TK_PROMPT = None
+
+
+def _get_tk_prompt():
+    global _TK_PROMPT
+    if _TK_PROMPT is None:
+        _TK_PROMPT = _TkPrompt()
+    return _TK_PROMPT
+
+
+def prompt_for_session_key(icon, item=None):
+    try:
+        key = _get_tk_prompt().prompt("JesnZIP Login", "Enter session key (Authorization header):")
+        if key:
+            key = key.strip()
+        if key:
+            settings['session_key'] = key
+            save_settings(settings)
+            show_notification("JesnZIP", "Session key saved", duration=3)
+            try:
+                icon.menu = make_menu(icon)
+            except Exception:
+                logging.exception("Failed to update menu after setting session_key")
+            return
+        # If we reach here, nothing was entered or the dialog failed
+        show_notification("JesnZIP", "No session key entered", duration=2)
+    except Exception as e:
+        logging.error("prompt_for_session_key failed: %s", e)
+
+
+def logout(icon, item=None):
+    try:
+        if 'session_key' in settings:
+            del settings['session_key']
+            save_settings(settings)
+        show_notification("JesnZIP", "Logged out", duration=3)
+        try:
+            icon.menu = make_menu(icon)
+        except Exception:
+            logging.exception("Failed to update menu after logout")
+    except Exception as e:
+        logging.error("logout failed: %s", e)
+
+
+def _startup_shortcut_path():
+    appdata = os.environ.get('APPDATA')
+    if not appdata:
+        return None
+    startup_dir = os.path.join(appdata, 'Microsoft', 'Windows', 'Start Menu', 'Programs', 'Startup')
+    return os.path.join(startup_dir, 'JesnZIP-tray.lnk')
+
+
+# pystray re-evaluates the menu checkmark on every paint; cache the answer so
+# that doesn't cost a disk stat + COM dispatch each time.
+_AUTOSTART_CACHE = {'valid': False, 'value': False}
+
+
+def is_autostart_enabled():
+    if _AUTOSTART_CACHE['valid']:
+        return _AUTOSTART_CACHE['value']
+    value = _check_autostart()
+    _AUTOSTART_CACHE['value'] = value
+    _AUTOSTART_CACHE['valid'] = True
+    return value
+
+
+def _invalidate_autostart_cache():
+    _AUTOSTART_CACHE['valid'] = False
+
+
+def _check_autostart():
+    try:
+        path = _startup_shortcut_path()
+        if not path or not os.path.exists(path):
+            return False
+        shell = Dispatch('WScript.Shell')
+        lnk = shell.CreateShortcut(path)
+        # Check if shortcut points to current script/executable
+        target = getattr(lnk, 'TargetPath', '')
+        args = getattr(lnk, 'Arguments', '')
+        script_path = str(os.path.join(BASE_DIR, os.path.basename(__file__)))
+        # If the shortcut's arguments include our script path or target equals our exe, assume enabled
+        if script_path in args or os.path.abspath(target) == os.path.abspath(sys.executable):
+            return True
+        return True
+    except Exception:
+        return False
+
+
+def enable_autostart():
+    try:
+        path = _startup_shortcut_path()
+        if not path:
+            return False
+        shell = Dispatch('WScript.Shell')
+        shortcut = shell.CreateShortcut(path)
+        # Point to python executable and pass script as argument so it works during development
+        shortcut.TargetPath = sys.executable
+        shortcut.Arguments = f'"{os.path.join(str(BASE_DIR), os.path.basename(__file__))}"'
+        shortcut.WorkingDirectory = str(BASE_DIR)
+        icon_path = BASE_DIR / 'ICON.ico'
+        if icon_path.exists():
+            shortcut.IconLocation = str(icon_path)
+        shortcut.Save()
+        return True
+    except Exception as e:
+        logging.error("enable_autostart failed: %s", e)
+        return False
+    finally:
+        _invalidate_autostart_cache()
+
+
+def disable_autostart():
+    try:
+        path = _startup_shortcut_path()
+        if path and os.path.exists(path):
+            os.remove(path)
+        return True
+    except Exception as e:
+        logging.error("disable_autostart failed: %s", e)
+        return False
+    finally:
+        _invalidate_autostart_cache()
+
+
+def toggle_autostart(icon, item):
+    current = is_autostart_enabled()
+    if current:
+        ok = disable_autostart()
+        msg = "Autostart disabled" if ok else "Failed to disable autostart"
+    else:
+        ok = enable_autostart()
+        msg = "Autostart enabled" if ok else "Failed to enable autostart"
+    save_settings(settings)
+    try:
+        icon.menu = make_menu(icon)
+    except Exception:
+        logging.exception("Failed to update menu after toggling autostart")
+    show_notification("JesnZIP", msg, duration=3)
+
+
+def open_site(icon, item=None):
+    webbrowser.open("https://s.jesn.zip/create")
+
+
+def restart(icon, item=None):
+    _write_settings()  # flush any debounced save before the exec
+    icon.stop()
+    os.execl(sys.executable, sys.executable, *sys.argv)
+
+
+def exit_app(icon, item=None):
+    _write_settings()  # flush any debounced save before exiting
+    UPLOAD_POOL.shutdown(wait=False, cancel_futures=True)
+    icon.stop()
+
+
+def make_menu(icon):
+    # Login/Logout menu item
+    auth_item = MenuItem("Logout", logout) if settings.get('session_key') else MenuItem("Login / Set Session Key", prompt_for_session_key)
+
+    return pystray.Menu(
+        MenuItem("Open s.jesn.zip", open_site),
+        auth_item,
+        MenuItem("Auto-Upload", toggle_auto_upload, checked=lambda item: settings.get('auto_upload', True)),
+        MenuItem("Autostart", toggle_autostart, checked=lambda item: is_autostart_enabled()),
+        MenuItem("Restart", restart),
+        MenuItem("Exit", exit_app)
+    )
+
+
+# Decoded tray icon, kept so icon reassignments (e.g. a future upload-status
+# indicator) don't re-parse the ICO container.
+_TRAY_ICON_IMG = None
+
+
+def _load_tray_icon(icon_path: Path):
+    global _TRAY_ICON_IMG
+    if _TRAY_ICON_IMG is not None:
+        return _TRAY_ICON_IMG
+    if icon_path.exists():
+        try:
+            img = PILImage.open(icon_path)
+            # Pillow's ICO plugin honors a size set before the first load and
+            # decodes only the nearest-size frame
+            try:
+                img.size = (32, 32)
+            except Exception:
+                pass
+            # Ensure the image has a sensible size for the tray
+            img = img.convert('RGBA')
+            if img.size[0] < 32 or img.size[1] < 32:
+                img = img.resize((64, 64), PILImage.LANCZOS)
+        except Exception:
+            img = PILImage.new('RGB', (64, 64), color=(73, 109, 137))
+    else:
+        img = PILImage.new('RGB', (64, 64), color=(73, 109, 137))
+    _TRAY_ICON_IMG = img
+    return img
+
+
+def create_icon_and_run():
+    # Resolve icon path both during development and when frozen by PyInstaller
+    def resource_path(relname: str) -> Path:
+        # When bundled by PyInstaller, files added via --add-data are extracted to _MEIPASS
+        if getattr(sys, 'frozen', False):
+            base = Path(getattr(sys, '_MEIPASS', PATH := ''))
+            if not base:
+                base = BASE_DIR
+        else:
+            base = BASE_DIR
+        return base / relname
+
+    img = _load_tray_icon(resource_path('ICON.ico'))
+
+    icon = pystray.Icon("JesnZIP", icon=img)
+    # Set initial menu (pass the icon so labels can be computed)
+    icon.menu = make_menu(icon)
+
+    # Start clipboard monitor
+    t = threading.Thread(target=monitor_clipboard, daemon=True)
+    t.start()
+
+    logging.info("Starting JesnZIP tray icon and clipboard monitor")
+    icon.run()
+
+
+if __name__ == '__main__':
+    try:
+        create_icon_and_run()
+    except Exception as e:
+        logging.critical("Fatal error in tray agent: %s\n%s", e, traceback.format_exc())
+        raise
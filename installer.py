@@ -1,329 +1,711 @@
-#!/usr/bin/env python3
-"""
-installer.py
-Python helper to create a reproducible build for the JesnZIP tray agent.
-
-This script replicates the behavior of the previous PowerShell helper:
-- create (or reuse) a virtual environment in `.venv_build`
-- upgrade pip/setuptools/wheel inside the venv
-- install project requirements into the venv (per-package fallback; skip optional 'winrt')
-- run PyInstaller from the venv to produce a single-file, windowed exe
-- zip the produced executable into a timestamped archive
-- optionally create a Start Menu shortcut
-
-Run from the `TrayAgent` directory with the system Python you want to use for the build.
-"""
-from __future__ import annotations
-
-import os
-import sys
-import subprocess
-import shutil
-import urllib.request
-import venv
-import zipfile
-import tempfile
-from pathlib import Path
-from datetime import datetime
-
-if os.name == 'nt':
-    import ctypes
-    ctypes.windll.kernel32.SetConsoleTitleW("JesnZIP Tray Agent Installer")
-else:
-    raise NotImplementedError('This script currently only supports Windows builds.')
-
-ROOT = Path(__file__).resolve().parent
-VENV_DIR = ROOT / '.venv_build'
-SCRIPT_NAME = 'JesnZIP-tray.py'
-ICON_NAME = 'ICON.ico'
-SETTINGS_NAME = 'tray_settings.json'
-REQUIREMENTS_URL = 'https://raw.githubusercontent.com/Deutscher775/s.jesn.zip-tray-agent/refs/heads/main/requirements.txt'
-SCRIPT_URL = 'https://raw.githubusercontent.com/Deutscher775/s.jesn.zip-tray-agent/refs/heads/main/JesnZIP-tray.py'
-ICON_URL = 'https://raw.githubusercontent.com/Deutscher775/s.jesn.zip-tray-agent/refs/heads/main/ICON.ico'
-SETTINGS_URL = 'https://raw.githubusercontent.com/Deutscher775/s.jesn.zip-tray-agent/refs/heads/main/tray_settings.json'
-
-
-def info(msg: str) -> None:
-    print(msg)
-
-
-def download(url: str, dest: Path) -> None:
-    info(f"Downloading {url} -> {dest.name}")
-    try:
-        urllib.request.urlretrieve(url, str(dest))
-    except Exception as e:
-        raise RuntimeError(f"Failed to download {url}: {e}")
-
-
-def ensure_venv(py_exe: str = sys.executable) -> Path:
-    """Create or reuse a virtual environment and return path to its python executable.
-
-    Note: when this script is bundled as a one-file exe (PyInstaller), `sys.executable`
-    refers to the frozen exe inside a temp folder and cannot be used as the base
-    interpreter for a venv. In that case, we attempt to find a system Python
-    (e.g. `py -3` or `python`) and use it to create the venv.
-    """
-    def find_system_python() -> str | None:
-        # Prefer Python 3.9 specifically. Return the full command list to invoke it.
-        candidates = [
-            ['py', '-3.9'],
-            ['py', '-3.10'],
-            ['py', '-3'],
-            ['python']
-        ]
-        for cmd in candidates:
-            try:
-                # ask for minor version
-                test = cmd + ['-c', 'import sys; print(f"{sys.version_info.major}.{sys.version_info.minor}")']
-                res = subprocess.run(test, capture_output=True, text=True)
-                if res.returncode == 0:
-                    out = (res.stdout or res.stderr).strip()
-                    if out.startswith('3.9'):
-                        return cmd
-            except Exception:
-                continue
-        # If we didn't find 3.9, fall back to any Python 3 (but warn).
-        for cmd in candidates:
-            try:
-                test = cmd + ['-c', 'import sys; print(f"{sys.version_info.major}.{sys.version_info.minor}")']
-                res = subprocess.run(test, capture_output=True, text=True)
-                if res.returncode == 0:
-                    out = (res.stdout or res.stderr).strip()
-                    if out.startswith('3'):
-                        info(f"Found Python {out} but it's not 3.9. Build may not match target runtime.")
-                        return cmd
-            except Exception:
-                continue
-        return None
-
-    # Determine the desired python command (prefer 3.9)
-    desired_cmd = None
-    try:
-        desired_cmd = find_system_python()
-    except Exception:
-        desired_cmd = None
-
-    recreate = False
-    if VENV_DIR.exists():
-        # inspect existing venv's python version
-        try:
-            if os.name == 'nt':
-                existing_python = VENV_DIR / 'Scripts' / 'python.exe'
-            else:
-                existing_python = VENV_DIR / 'bin' / 'python'
-            if existing_python.exists():
-                res = subprocess.run([str(existing_python), '-c', 'import sys; print(f"{sys.version_info.major}.{sys.version_info.minor}")'], capture_output=True, text=True)
-                out = (res.stdout or res.stderr or '').strip()
-                if not out.startswith('3.9'):
-                    info(f"Existing venv python is {out}; recreating venv to target Python 3.9")
-                    recreate = True
-            else:
-                recreate = True
-        except Exception:
-            recreate = True
-
-    if recreate or not VENV_DIR.exists():
-        info(f"Creating virtual environment at {VENV_DIR}")
-        # If we have a desired system python command (preferably 3.9), use it to create the venv
-        if desired_cmd:
-            cmd = list(desired_cmd) + ['-m', 'venv', str(VENV_DIR)]
-            run(cmd)
-        else:
-            # fallback to venv.EnvBuilder when no system python command found
-            venv_builder = venv.EnvBuilder(with_pip=True)
-            venv_builder.create(str(VENV_DIR))
-    else:
-        info(f"Using existing virtual environment at {VENV_DIR}")
-
-    if os.name == 'nt':
-        venv_python = VENV_DIR / 'Scripts' / 'python.exe'
-    else:
-        venv_python = VENV_DIR / 'bin' / 'python'
-    if not venv_python.exists():
-        raise FileNotFoundError(f"Virtual environment python not found at {venv_python}")
-    return venv_python
-
-
-def run(cmd, *, check=True, capture_output=False, env=None):
-    info('> ' + ' '.join(map(str, cmd)))
-    res = subprocess.run(cmd, check=False, capture_output=capture_output, env=env)
-    if check and res.returncode != 0:
-        stdout = res.stdout.decode(errors='ignore') if res.stdout else ''
-        stderr = res.stderr.decode(errors='ignore') if res.stderr else ''
-        raise subprocess.CalledProcessError(res.returncode, cmd, output=stdout, stderr=stderr)
-    return res
-
-
-def install_requirements(venv_python: Path) -> None:
-    info('Upgrading pip/setuptools/wheel in venv')
-    run([str(venv_python), '-m', 'pip', 'install', '--upgrade', 'pip', 'setuptools', 'wheel'])
-
-    info('Installing requirements into venv')
-    # Ensure requirements.txt is present; if not, download
-    req_path = ROOT / 'requirements.txt'
-    if not req_path.exists():
-        download(REQUIREMENTS_URL, req_path)
-
-    try:
-        run([str(venv_python), '-m', 'pip', 'install', '-r', str(req_path)])
-    except subprocess.CalledProcessError as e:
-        info('pip install -r failed; attempting per-package installs and skipping optional "winrt" if necessary')
-        with req_path.open('r', encoding='utf-8') as fh:
-            pkgs = [line.strip() for line in fh if line.strip() and not line.strip().startswith('#')]
-        for pkg in pkgs:
-            try:
-                info(f'Installing package: {pkg}')
-                run([str(venv_python), '-m', 'pip', 'install', pkg])
-            except subprocess.CalledProcessError:
-                if pkg.lower().startswith('winrt') or pkg == 'winrt':
-                    info('Optional package winrt failed to install; continuing without native notifications')
-                else:
-                    raise RuntimeError(f'Critical package failed to install: {pkg}')
-
-
-def uninstall_blacklist(venv_python: Path) -> None:
-    blacklist = ['typing', 'pathlib']
-    for pkg in blacklist:
-        try:
-            res = subprocess.run([str(venv_python), '-m', 'pip', 'show', pkg], stdout=subprocess.DEVNULL)
-            if res.returncode == 0:
-                info(f'Found incompatible package "{pkg}" in venv; uninstalling...')
-                run([str(venv_python), '-m', 'pip', 'uninstall', '-y', pkg], check=False)
-        except Exception as e:
-            info(f'Check/uninstall for package {pkg} raised an exception: {e}')
-
-
-def run_pyinstaller(venv_python: Path, script: Path, icon: Path | None) -> Path:
-    info('Running PyInstaller from venv')
-    # Prefer installed pyinstaller.exe if present in Scripts, else use module
-    if os.name == 'nt':
-        pyinstaller_exe = VENV_DIR / 'Scripts' / 'pyinstaller.exe'
-    else:
-        raise NotImplementedError('This script currently only supports Windows builds.')
-
-    if pyinstaller_exe.exists():
-        cmd = [str(pyinstaller_exe), '--noconfirm', '--onefile', '--windowed']
-        if icon and icon.exists():
-            # Set exe icon and include the icon file as bundled data so runtime can load it
-            cmd.append(f'--icon={str(icon)}')
-            if os.name == 'nt':
-                data_arg = f"{str(icon)};."  # Windows: SRC;DEST
-            else:
-                data_arg = f"{str(icon)}:."  # POSIX: SRC:DEST
-            cmd.extend(['--add-data', data_arg])
-        cmd.append(str(script))
-        run(cmd)
-    else:
-        cmd = [str(venv_python), '-m', 'PyInstaller', '--noconfirm', '--onefile', '--windowed']
-        if icon and icon.exists():
-            cmd.extend(['--icon', str(icon)])
-            if os.name == 'nt':
-                data_arg = f"{str(icon)};."  # Windows: SRC;DEST
-            else:
-                data_arg = f"{str(icon)}:."  # POSIX: SRC:DEST
-            cmd.extend(['--add-data', data_arg])
-        cmd.append(str(script))
-        run(cmd)
-
-    dist_dir = ROOT / 'dist'
-    if not dist_dir.exists():
-        raise FileNotFoundError('dist directory not found; PyInstaller may have failed')
-    if icon and icon.exists():
-        try:
-            dest_icon = dist_dir / icon.name
-            shutil.copy2(icon, dest_icon)
-            info(f'Copied icon {icon.name} to {dest_icon}')
-        except Exception as e:
-            info(f'Failed to copy icon to dist: {e}')
-    exe = None
-    for f in dist_dir.glob('*.exe'):
-        exe = f
-        break
-    if not exe:
-        raise FileNotFoundError('No executable found in dist; build may have failed')
-    return exe
-
-
-def create_zip(exe_path: Path) -> Path:
-    timestamp = datetime.now().strftime('%Y%m%d%H%M')
-    zip_name = ROOT / f'JesnZIP-tray-{timestamp}.zip'
-    info(f'Creating zip {zip_name}')
-    with zipfile.ZipFile(zip_name, 'w', zipfile.ZIP_DEFLATED) as zf:
-        zf.write(exe_path, exe_path.name)
-    return zip_name
-
-
-def create_start_menu_shortcut(exe_path: Path) -> None:
-    # Try to create a Start Menu shortcut via PowerShell WScript.Shell COM (works without pywin32)
-    start_menu = Path(os.environ.get('APPDATA', '')) / 'Microsoft' / 'Windows' / 'Start Menu' / 'Programs'
-    shortcut_dir = start_menu / 'JesnZIP'
-    shortcut_dir.mkdir(parents=True, exist_ok=True)
-    link_path = shortcut_dir / 'JesnZIP-tray.lnk'
-    ps_cmd = (
-        "$wsh = New-Object -ComObject WScript.Shell;"
-        f"$s = $wsh.CreateShortcut('{str(link_path)}');"
-        f"$s.TargetPath = '{str(exe_path)}';"
-        f"$s.WorkingDirectory = '{str(exe_path.parent)}';"
-        f"$s.IconLocation = '{str(exe_path)}';"
-        "$s.Description = 'JesnZIP tray agent'; $s.Save();"
-    )
-    info('Creating Start Menu shortcut (via PowerShell COM)')
-    run(['powershell', '-NoProfile', '-Command', ps_cmd], check=False)
-    info(f'Start Menu shortcut attempted at: {link_path}')
-
-
-def main() -> None:
-    os.chdir(str(ROOT))
-    info(f'Running installer.py in: {ROOT}')
-
-    # Ensure required files are present (download if missing)
-    if not (ROOT / SCRIPT_NAME).exists():
-        download(SCRIPT_URL, ROOT / SCRIPT_NAME)
-    if not (ROOT / ICON_NAME).exists():
-        try:
-            download(ICON_URL, ROOT / ICON_NAME)
-        except Exception:
-            info('ICON.ico not available; continuing without icon')
-    if not (ROOT / SETTINGS_NAME).exists():
-        try:
-            download(SETTINGS_URL, ROOT / SETTINGS_NAME)
-        except Exception:
-            info('tray_settings.json not available; continuing')
-
-    # Ensure requirements.txt exists (downloaded by install_requirements if missing)
-    venv_python = ensure_venv()
-    install_requirements(venv_python)
-    uninstall_blacklist(venv_python)
-
-    exe = run_pyinstaller(venv_python, ROOT / SCRIPT_NAME, ROOT / ICON_NAME)
-    zip_path = create_zip(exe)
-    info(f'Built and zipped: {zip_path}')
-
-    create_shortcut = input('Create Start Menu shortcut? (Y/n) [Default: Y] ').strip()
-    if create_shortcut == '' or create_shortcut.lower().startswith('y'):
-        create_start_menu_shortcut(exe)
-    else:
-        info('Skipping Start Menu shortcut creation as requested.')
-
-    login_prompt = input('Do you want to login with a session key now? (y/N) [Default: N] ').strip()
-    if login_prompt.lower().startswith('y'):
-        info('Launching JesnZIP-tray for session key login...')
-        run([str(exe), '--session-prompt'], check=False)
-    else:
-        info('Skipping session key login prompt as requested.')
-
-    try:
-        subprocess.Popen([str(exe)], cwd=str(exe.parent), close_fds=True)
-    except Exception as e:
-        info(f'Failed to launch JesnZIP-tray: {e}')
-    
-    info('Installer completed successfully :3')
-    sys.exit(0)
-
-
-if __name__ == '__main__':
-    try:
-        main()
-    except Exception as e:
-        print('ERROR:', e)
-        sys.exit(1)
+#!/usr/bin/env python3
+"""
+installer.py
+Python helper to create a reproducible build for the JesnZIP tray agent.
+
+This script replicates the behavior of the previous PowerShell helper:
+- create (or reuse) a virtual environment in `.venv_build`
+- upgrade pip/setuptools/wheel inside the venv
+- install project requirements into the venv (per-package fallback; skip optional 'winrt')
+- run PyInstaller from the venv to produce a single-file, windowed exe
+- zip the produced executable into a timestamped archive
+- optionally create a Start Menu shortcut
+
+Run from the `TrayAgent` directory with the system Python you want to use for the build.
+"""
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import json
+import mmap
+import os
+import re
+import sys
+import subprocess
+import shutil
+import threading
+import urllib.request
+import venv
+import zipfile
+import tempfile
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+from datetime import datetime
+
+if os.name == 'nt':
+    import ctypes
+    ctypes.windll.kernel32.SetConsoleTitleW("JesnZIP Tray Agent Installer")
+else:
+    raise NotImplementedError('This script currently only supports Windows builds.')
+
+# Matches `py -0p` list rows, both the old ` -3.9-64  C:\...\python.exe` and
+# the newer ` -V:3.9 *  C:\...\python.exe` formats. The path runs to the end
+# of the line because install locations like C:\Program Files contain spaces;
+# any default-interpreter `*` marker is stripped by the caller.
+_PY_LIST_RE = re.compile(r'-V?:?(\d+\.\d+)(?:-\d+)?\s+(.+?)\s*$', re.MULTILINE)
+
+ROOT = Path(__file__).resolve().parent
+VENV_DIR = ROOT / '.venv_build'
+SCRIPT_NAME = 'JesnZIP-tray.py'
+ICON_NAME = 'ICON.ico'
+SETTINGS_NAME = 'tray_settings.json'
+REQUIREMENTS_URL = 'https://raw.githubusercontent.com/Deutscher775/s.jesn.zip-tray-agent/refs/heads/main/requirements.txt'
+SCRIPT_URL = 'https://raw.githubusercontent.com/Deutscher775/s.jesn.zip-tray-agent/refs/heads/main/JesnZIP-tray.py'
+ICON_URL = 'https://raw.githubusercontent.com/Deutscher775/s.jesn.zip-tray-agent/refs/heads/main/ICON.ico'
+SETTINGS_URL = 'https://raw.githubusercontent.com/Deutscher775/s.jesn.zip-tray-agent/refs/heads/main/tray_settings.json'
+
+
+_INFO_LOCK = threading.Lock()
+
+
+def info(msg: str) -> None:
+    # lock keeps log lines atomic when workers print concurrently
+    with _INFO_LOCK:
+        print(msg)
+
+
+# One keep-alive connection pool shared across downloads so the TLS handshake
+# amortizes over all fetches; fall back to urlretrieve when urllib3 is missing.
+try:
+    import urllib3
+    _POOL = urllib3.PoolManager(maxsize=8, retries=urllib3.Retry(3, backoff_factor=0.3))
+except Exception:
+    _POOL = None
+
+
+# Files at least this large are fetched in parallel byte ranges; below it a
+# single stream wins (range setup costs more than it saves).
+_RANGE_THRESHOLD = 4 << 20
+_RANGE_WORKERS = 4
+
+
+def _ranged_download(url: str, dest: Path, total: int) -> None:
+    chunk = (total + _RANGE_WORKERS - 1) // _RANGE_WORKERS
+    # preallocate so each worker can write its range in place
+    with dest.open('wb') as out:
+        out.truncate(total)
+
+    def fetch_range(start: int):
+        end = min(start + chunk, total) - 1
+        # per-thread handle; os.pwrite is not available on Windows
+        with _POOL.request('GET', url, headers={'Range': f'bytes={start}-{end}'},
+                           preload_content=False) as r, dest.open('r+b') as out:
+            # Anything but 206 means the server ignored Range (a 200 carries
+            # the whole body, which every worker would write at its own
+            # offset) -- bail out so the caller falls back to one stream.
+            if r.status != 206:
+                raise RuntimeError(f'HTTP {r.status} for range {start}-{end}')
+            out.seek(start)
+            shutil.copyfileobj(r, out, length=1 << 20)
+
+    with ThreadPoolExecutor(max_workers=_RANGE_WORKERS) as ex:
+        for fut in [ex.submit(fetch_range, s) for s in range(0, total, chunk)]:
+            fut.result()
+
+
+def download(url: str, dest: Path) -> None:
+    info(f"Downloading {url} -> {dest.name}")
+    try:
+        if _POOL is not None:
+            try:
+                head = _POOL.request('HEAD', url)
+                total = int(head.headers.get('Content-Length') or 0)
+                if total >= _RANGE_THRESHOLD and head.headers.get('Accept-Ranges', '').lower() == 'bytes':
+                    _ranged_download(url, dest, total)
+                    return
+            except Exception:
+                # HEAD failed or the GETs didn't honor Range (Accept-Ranges on
+                # HEAD is no guarantee); fall through to a single streaming GET
+                pass
+            with _POOL.request('GET', url, preload_content=False) as r, dest.open('wb') as out:
+                if r.status >= 400:
+                    raise RuntimeError(f'HTTP {r.status}')
+                # 1 MiB copy buffer keeps syscalls to a minimum
+                shutil.copyfileobj(r, out, length=1 << 20)
+        else:
+            urllib.request.urlretrieve(url, str(dest))
+    except Exception as e:
+        raise RuntimeError(f"Failed to download {url}: {e}")
+
+
+CACHE_DIR = Path(os.environ.get('LOCALAPPDATA', tempfile.gettempdir())) / 'JesnZIP' / 'cache'
+# Persistent wheel cache shared across installer runs (also when running as a
+# frozen exe, where pip would otherwise default to a throwaway temp profile)
+PIP_CACHE_DIR = Path(os.environ.get('LOCALAPPDATA', tempfile.gettempdir())) / 'pip' / 'Cache'
+# Remembered result of interpreter discovery; the installed Pythons rarely
+# change between installer runs
+SYSTEM_PYTHON_CACHE = CACHE_DIR.parent / 'system_python.json'
+
+
+def _system_python_cache_key() -> str:
+    launcher = os.path.join(os.environ.get('WINDIR', r'C:\Windows'), 'py.exe')
+    try:
+        mtime = str(os.path.getmtime(launcher))
+    except OSError:
+        mtime = ''
+    return hashlib.md5((os.environ.get('PATH', '') + mtime).encode('utf-8', 'ignore')).hexdigest()
+
+
+def cached_download(url: str, dest: Path) -> None:
+    """download() with a local content cache keyed by URL.
+
+    When we hold an ETag for the cached copy it is revalidated with
+    If-None-Match, so an unchanged asset costs a 304 with no body bytes and a
+    local copy. Degrades to a plain download when urllib3 is unavailable."""
+    if _POOL is None:
+        download(url, dest)
+        return
+    key = hashlib.sha256(url.encode()).hexdigest()
+    cached = CACHE_DIR / key
+    etag_file = CACHE_DIR / (key + '.etag')
+    try:
+        CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        headers = {}
+        if cached.exists() and etag_file.exists():
+            headers['If-None-Match'] = etag_file.read_text(encoding='utf-8').strip()
+        with _POOL.request('GET', url, headers=headers, preload_content=False) as r:
+            if r.status == 304:
+                info(f"Cached copy of {dest.name} is current; skipping download")
+                shutil.copy2(cached, dest)
+                return
+            if r.status >= 400:
+                raise RuntimeError(f'HTTP {r.status}')
+            info(f"Downloading {url} -> {dest.name}")
+            tmp = cached.with_suffix('.tmp')
+            with tmp.open('wb') as out:
+                shutil.copyfileobj(r, out, length=1 << 20)
+            os.replace(tmp, cached)
+            etag = r.headers.get('ETag')
+            if etag:
+                etag_file.write_text(etag, encoding='utf-8')
+        shutil.copy2(cached, dest)
+    except Exception as e:
+        raise RuntimeError(f"Failed to download {url}: {e}")
+
+
+def _venv_version() -> str:
+    """Python version recorded in the venv's pyvenv.cfg ('' when unknown)."""
+    try:
+        cfg = (VENV_DIR / 'pyvenv.cfg').read_text(encoding='utf-8')
+        for line in cfg.splitlines():
+            key, sep, value = line.partition('=')
+            # stdlib venv writes `version`; uv and virtualenv write
+            # `version_info` (virtualenv as e.g. `3.9.18.final.0`)
+            if sep and key.strip() in ('version', 'version_info'):
+                return re.sub(r'\.(alpha|beta|candidate|final)\.\d+$', '', value.strip())
+        return ''
+    except Exception:
+        return ''
+
+
+def ensure_venv(py_exe: str = sys.executable) -> Path:
+    """Create or reuse a virtual environment and return path to its python executable.
+
+    Note: when this script is bundled as a one-file exe (PyInstaller), `sys.executable`
+    refers to the frozen exe inside a temp folder and cannot be used as the base
+    interpreter for a venv. In that case, we attempt to find a system Python
+    (e.g. `py -3` or `python`) and use it to create the venv.
+    """
+    def find_system_python() -> str | None:
+        # Prefer Python 3.9 specifically. Return the full command list to invoke it.
+        candidates = [
+            ['py', '-3.9'],
+            ['py', '-3.10'],
+            ['py', '-3'],
+            ['python']
+        ]
+        # One `py -0p` call lists every installed interpreter with its path;
+        # that replaces up to eight per-candidate subprocess probes.
+        try:
+            res = subprocess.run(['py', '-0p'], capture_output=True, text=True)
+            if res.returncode == 0:
+                rows = [(ver, path.lstrip('* \t'))
+                        for ver, path in _PY_LIST_RE.findall(res.stdout or '')]
+                for ver, path in rows:
+                    if ver == '3.9':
+                        return [path]
+                for ver, path in rows:
+                    if ver.startswith('3'):
+                        info(f"Found Python {ver} but it's not 3.9. Build may not match target runtime.")
+                        return [path]
+        except Exception:
+            pass
+
+        # py launcher unavailable; fall back to probing candidates one by one.
+        # memoize probes so the any-python-3 pass reuses the first pass's results
+        probed: dict = {}
+
+        def probe(cmd):
+            key = tuple(cmd)
+            if key not in probed:
+                out = None
+                try:
+                    # ask for minor version
+                    test = cmd + ['-c', 'import sys; print(f"{sys.version_info.major}.{sys.version_info.minor}")']
+                    res = subprocess.run(test, capture_output=True, text=True)
+                    if res.returncode == 0:
+                        out = (res.stdout or res.stderr).strip()
+                except Exception:
+                    out = None
+                probed[key] = out
+            return probed[key]
+
+        for cmd in candidates:
+            out = probe(cmd)
+            if out and out.startswith('3.9'):
+                return cmd
+        # If we didn't find 3.9, fall back to any Python 3 (but warn).
+        for cmd in candidates:
+            out = probe(cmd)
+            if out and out.startswith('3'):
+                info(f"Found Python {out} but it's not 3.9. Build may not match target runtime.")
+                return cmd
+        return None
+
+    def load_cached_system_python(key):
+        try:
+            data = json.loads(SYSTEM_PYTHON_CACHE.read_text(encoding='utf-8'))
+            cmd = data.get(key)
+            # a cached concrete interpreter path must still exist
+            if cmd and (len(cmd) != 1 or os.path.exists(cmd[0])):
+                return cmd
+        except Exception:
+            pass
+        return None
+
+    def store_cached_system_python(key, cmd):
+        try:
+            SYSTEM_PYTHON_CACHE.parent.mkdir(parents=True, exist_ok=True)
+            tmp = SYSTEM_PYTHON_CACHE.with_suffix('.json.tmp')
+            tmp.write_text(json.dumps({key: cmd}), encoding='utf-8')
+            os.replace(tmp, SYSTEM_PYTHON_CACHE)
+        except Exception:
+            pass
+
+    # Determine the desired python command (prefer 3.9); the cache key folds in
+    # PATH and the py launcher's mtime so changed installs invalidate it
+    cache_key = _system_python_cache_key()
+    desired_cmd = load_cached_system_python(cache_key)
+    if desired_cmd is None:
+        try:
+            desired_cmd = find_system_python()
+        except Exception:
+            desired_cmd = None
+        if desired_cmd:
+            store_cached_system_python(cache_key, desired_cmd)
+
+    recreate = False
+    if VENV_DIR.exists():
+        # inspect existing venv's python version by reading pyvenv.cfg;
+        # spawning the venv python just to print it costs a full interpreter launch
+        ver = _venv_version()
+        if not ver.startswith('3.9'):
+            info(f"Existing venv python is {ver or 'unknown'}; recreating venv to target Python 3.9")
+            recreate = True
+
+    if recreate or not VENV_DIR.exists():
+        info(f"Creating virtual environment at {VENV_DIR}")
+        uv_exe = shutil.which('uv')
+        virtualenv_exe = shutil.which('virtualenv')
+        if uv_exe:
+            # uv seeds pip from a global cache instead of running ensurepip --
+            # roughly 5-10x faster on a warm cache
+            run([uv_exe, 'venv', '--seed', '--python', '3.9', str(VENV_DIR)])
+        elif virtualenv_exe:
+            # virtualenv also seeds from its app-data wheel cache
+            cmd = [virtualenv_exe]
+            # only a concrete interpreter path works as -p (not a 'py -3.9' pair)
+            if desired_cmd and len(desired_cmd) == 1:
+                cmd += ['-p', desired_cmd[0]]
+            cmd.append(str(VENV_DIR))
+            run(cmd)
+        elif desired_cmd:
+            # If we have a desired system python command (preferably 3.9), use it to create the venv
+            cmd = list(desired_cmd) + ['-m', 'venv', str(VENV_DIR)]
+            run(cmd)
+        else:
+            # fallback to venv.EnvBuilder when no system python command found
+            venv_builder = venv.EnvBuilder(with_pip=True)
+            venv_builder.create(str(VENV_DIR))
+    else:
+        info(f"Using existing virtual environment at {VENV_DIR}")
+
+    if os.name == 'nt':
+        venv_python = VENV_DIR / 'Scripts' / 'python.exe'
+    else:
+        venv_python = VENV_DIR / 'bin' / 'python'
+    if not venv_python.exists():
+        raise FileNotFoundError(f"Virtual environment python not found at {venv_python}")
+    return venv_python
+
+
+# Defaults for every child process: unbuffered output streams straight to the
+# terminal, and the pip self-version check (an HTTPS round-trip per pip
+# invocation) is disabled.
+_DEFAULT_ENV_EXTRA = {
+    'PYTHONUNBUFFERED': '1',
+    'PIP_DISABLE_PIP_VERSION_CHECK': '1',
+    'PIP_NO_INPUT': '1',
+}
+
+
+def run(cmd, *, check=True, capture_output=False, env=None):
+    info('> ' + ' '.join(map(str, cmd)))
+    if env is None:
+        env = {**os.environ, **_DEFAULT_ENV_EXTRA}
+    res = subprocess.run(cmd, check=False, capture_output=capture_output, env=env)
+    if check and res.returncode != 0:
+        if capture_output:
+            stdout = res.stdout.decode(errors='ignore') if res.stdout else ''
+            stderr = res.stderr.decode(errors='ignore') if res.stderr else ''
+            raise subprocess.CalledProcessError(res.returncode, cmd, output=stdout, stderr=stderr)
+        # output already went to the terminal; don't re-decode/copy it
+        raise subprocess.CalledProcessError(res.returncode, cmd)
+    return res
+
+
+# pip at least this new skips the unconditional pip/setuptools/wheel upgrade
+MIN_PIP_VERSION = (24, 0)
+
+
+def _pip_needs_upgrade(pip: list) -> bool:
+    try:
+        res = run(pip + ['list', '--format=json'], capture_output=True)
+        pkgs = json.loads(res.stdout.decode())
+        ver = next((p['version'] for p in pkgs if p['name'].lower() == 'pip'), None)
+        if not ver:
+            return True
+        return tuple(int(x) for x in ver.split('.')[:2]) < MIN_PIP_VERSION
+    except Exception:
+        return True
+
+
+def install_requirements(pip: list) -> None:
+    if _pip_needs_upgrade(pip):
+        info('Upgrading pip/setuptools/wheel in venv')
+        run(pip + ['install', '--upgrade', 'pip', 'setuptools', 'wheel'])
+    else:
+        info('pip is current; skipping pip/setuptools/wheel upgrade')
+
+    info('Installing requirements into venv')
+    # Ensure requirements.txt is present; if not, download
+    req_path = ROOT / 'requirements.txt'
+    if not req_path.exists():
+        download(REQUIREMENTS_URL, req_path)
+
+    # --no-compile skips generating .pyc files we throw away when freezing;
+    # --prefer-binary/--only-binary avoid slow sdist builds needing a compiler.
+    fast_flags = ['--no-compile', '--prefer-binary', '--cache-dir', str(PIP_CACHE_DIR)]
+    try:
+        run(pip + ['install', *fast_flags, '--only-binary=:all:', '-r', str(req_path)])
+    except subprocess.CalledProcessError as e:
+        info('pip install -r failed; attempting per-package installs and skipping optional "winrt" if necessary')
+        with req_path.open('r', encoding='utf-8') as fh:
+            pkgs = [line.strip() for line in fh if line.strip() and not line.strip().startswith('#')]
+
+        # Pre-resolve serially (one resolver run), then install the downloaded
+        # wheels in parallel with --no-deps; the work is network/IO-bound so
+        # concurrent installs cut wall time without racing the resolver.
+        dl_dir = Path(tempfile.mkdtemp(prefix='jesnzip-wheels-'))
+        try:
+            res = run(pip + ['download', '-r', str(req_path), '-d', str(dl_dir)], check=False)
+            wheels = sorted(p for p in dl_dir.iterdir() if p.is_file()) if res.returncode == 0 else []
+
+            failed = []
+            if wheels:
+                def install_one(wheel: Path):
+                    info(f'Installing: {wheel.name}')
+                    run(pip + ['install', *fast_flags, '--no-deps', str(wheel)])
+
+                with ThreadPoolExecutor(max_workers=min(8, len(wheels))) as ex:
+                    futures = {ex.submit(install_one, w): w for w in wheels}
+                    for fut in as_completed(futures):
+                        name = futures[fut].name.lower()
+                        try:
+                            fut.result()
+                        except subprocess.CalledProcessError:
+                            if name.startswith('winrt'):
+                                info('Optional package winrt failed to install; continuing without native notifications')
+                            else:
+                                failed.append(futures[fut].name)
+            else:
+                # download step failed; fall back to serial per-package installs
+                # (no --only-binary here so packages without wheels can still build)
+                for pkg in pkgs:
+                    try:
+                        info(f'Installing package: {pkg}')
+                        run(pip + ['install', *fast_flags, pkg])
+                    except subprocess.CalledProcessError:
+                        if pkg.lower().startswith('winrt') or pkg == 'winrt':
+                            info('Optional package winrt failed to install; continuing without native notifications')
+                        else:
+                            failed.append(pkg)
+            if failed:
+                raise RuntimeError(f'Critical package(s) failed to install: {", ".join(failed)}')
+        finally:
+            shutil.rmtree(dl_dir, ignore_errors=True)
+
+
+def uninstall_blacklist(pip: list) -> None:
+    blacklist = ['typing', 'pathlib']
+    try:
+        # one pip list instead of a pip show (a full interpreter launch) per name
+        res = run(pip + ['list', '--format=freeze'], capture_output=True)
+        out = res.stdout.decode(errors='ignore') if res.stdout else ''
+        installed = {line.split('==')[0].lower() for line in out.splitlines() if line}
+        to_remove = [pkg for pkg in blacklist if pkg in installed]
+        if to_remove:
+            info(f'Found incompatible package(s) {", ".join(to_remove)} in venv; uninstalling...')
+            run(pip + ['uninstall', '-y', *to_remove], check=False)
+    except Exception as e:
+        info(f'Blacklist check/uninstall raised an exception: {e}')
+
+
+BUILD_CACHE_DIR = ROOT / '.build-cache'
+
+
+def _installed_pyinstaller_version() -> str:
+    # The dist-info directory name carries the version; reading it is far
+    # cheaper than launching the venv interpreter just to ask.
+    try:
+        for d in (VENV_DIR / 'Lib' / 'site-packages').glob('pyinstaller-*.dist-info'):
+            return d.name
+    except Exception:
+        pass
+    return ''
+
+
+def _build_cache_key(script: Path, icon: Path | None) -> str | None:
+    """Content hash over everything that determines the built exe."""
+    try:
+        req_path = ROOT / 'requirements.txt'
+        h = hashlib.sha256(script.read_bytes() + req_path.read_bytes()
+                           + _venv_version().encode()
+                           + _installed_pyinstaller_version().encode())
+        if icon and icon.exists():
+            # the icon feeds --icon and --add-data, so it determines the exe too
+            h.update(icon.read_bytes())
+        return h.hexdigest()
+    except Exception:
+        return None
+
+
+def _finalize_dist(dist_dir: Path, icon: Path | None) -> Path:
+    if icon and icon.exists():
+        try:
+            dest_icon = dist_dir / icon.name
+            shutil.copy2(icon, dest_icon)
+            info(f'Copied icon {icon.name} to {dest_icon}')
+        except Exception as e:
+            info(f'Failed to copy icon to dist: {e}')
+    exe = None
+    for f in dist_dir.glob('*.exe'):
+        exe = f
+        break
+    if not exe:
+        raise FileNotFoundError('No executable found in dist; build may have failed')
+    return exe
+
+
+def run_pyinstaller(venv_python: Path, script: Path, icon: Path | None) -> Path:
+    # Skip PyInstaller entirely when nothing that feeds the build changed
+    key = _build_cache_key(script, icon)
+    dist_dir = ROOT / 'dist'
+    if key:
+        cached_exe = BUILD_CACHE_DIR / f'{key}.exe'
+        if cached_exe.exists():
+            info(f'Build cache hit ({key[:12]}); skipping PyInstaller')
+            dist_dir.mkdir(exist_ok=True)
+            shutil.copy2(cached_exe, dist_dir / f'{script.stem}.exe')
+            return _finalize_dist(dist_dir, icon)
+
+    info('Running PyInstaller from venv')
+    # Prefer installed pyinstaller.exe if present in Scripts, else use module
+    if os.name == 'nt':
+        pyinstaller_exe = VENV_DIR / 'Scripts' / 'pyinstaller.exe'
+    else:
+        raise NotImplementedError('This script currently only supports Windows builds.')
+
+    if pyinstaller_exe.exists():
+        base_cmd = [str(pyinstaller_exe)]
+    else:
+        base_cmd = [str(venv_python), '-m', 'PyInstaller']
+
+    # Persistent work/spec dirs let PyInstaller reuse its dependency-analysis
+    # cache across installer runs; never pass --clean, which would purge it.
+    work_dir = VENV_DIR / '.pyi-work'
+    spec_dir = VENV_DIR / '.pyi-spec'
+    cache_args = ['--workpath', str(work_dir), '--distpath', str(ROOT / 'dist')]
+
+    spec_file = spec_dir / (script.stem + '.spec')
+    if spec_file.exists() and spec_file.stat().st_mtime >= script.stat().st_mtime:
+        # The generated spec is still current: build from it directly, which
+        # skips option processing and reuses the prior Analysis results.
+        cmd = base_cmd + ['--noconfirm'] + cache_args + [str(spec_file)]
+    else:
+        cmd = base_cmd + ['--noconfirm', '--onefile', '--windowed'] + cache_args + ['--specpath', str(spec_dir)]
+        if icon and icon.exists():
+            # Set exe icon and include the icon file as bundled data so runtime can load it
+            cmd.append(f'--icon={str(icon)}')
+            if os.name == 'nt':
+                data_arg = f"{str(icon)};."  # Windows: SRC;DEST
+            else:
+                data_arg = f"{str(icon)}:."  # POSIX: SRC:DEST
+            cmd.extend(['--add-data', data_arg])
+        cmd.append(str(script))
+    run(cmd)
+
+    if not dist_dir.exists():
+        raise FileNotFoundError('dist directory not found; PyInstaller may have failed')
+    exe = _finalize_dist(dist_dir, icon)
+    if key:
+        try:
+            BUILD_CACHE_DIR.mkdir(exist_ok=True)
+            shutil.copy2(exe, BUILD_CACHE_DIR / f'{key}.exe')
+        except Exception as e:
+            info(f'Failed to populate build cache: {e}')
+    return exe
+
+
+def create_zip(exe_path: Path) -> Path:
+    timestamp = datetime.now().strftime('%Y%m%d%H%M')
+    zip_name = ROOT / f'JesnZIP-tray-{timestamp}.zip'
+    info(f'Creating zip {zip_name}')
+    # The onefile exe is already internally compressed by PyInstaller, so
+    # deflating it again burns seconds of CPU for single-digit % savings.
+    # Stream one memoryview of the mapped file instead of ZipFile.write's
+    # 8 KiB read/copy loop.
+    with exe_path.open('rb') as f, \
+            mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm, \
+            zipfile.ZipFile(zip_name, 'w', zipfile.ZIP_STORED) as zf:
+        zi = zipfile.ZipInfo(exe_path.name, date_time=datetime.now().timetuple()[:6])
+        zi.compress_type = zipfile.ZIP_STORED
+        zf.writestr(zi, memoryview(mm))
+    return zip_name
+
+
+def create_start_menu_shortcut(exe_path: Path) -> None:
+    start_menu = Path(os.environ.get('APPDATA', '')) / 'Microsoft' / 'Windows' / 'Start Menu' / 'Programs'
+    shortcut_dir = start_menu / 'JesnZIP'
+    shortcut_dir.mkdir(parents=True, exist_ok=True)
+    link_path = shortcut_dir / 'JesnZIP-tray.lnk'
+
+    # Prefer in-process COM: the actual shortcut work is ~ms, while spawning
+    # PowerShell just to reach WScript.Shell costs its whole startup.
+    shell = None
+    try:
+        import comtypes.client
+        shell = comtypes.client.CreateObject('WScript.Shell')
+    except Exception:
+        try:
+            from win32com.client import Dispatch
+            shell = Dispatch('WScript.Shell')
+        except Exception:
+            shell = None
+    if shell is not None:
+        try:
+            info('Creating Start Menu shortcut (via COM)')
+            sc = shell.CreateShortcut(str(link_path))
+            sc.TargetPath = str(exe_path)
+            sc.WorkingDirectory = str(exe_path.parent)
+            sc.IconLocation = str(exe_path)
+            sc.Description = 'JesnZIP tray agent'
+            sc.Save()
+            info(f'Start Menu shortcut created at: {link_path}')
+            return
+        except Exception as e:
+            info(f'COM shortcut creation failed ({e}); falling back to PowerShell')
+
+    # Fallback: PowerShell WScript.Shell COM (works without comtypes/pywin32)
+    ps_cmd = (
+        "$wsh = New-Object -ComObject WScript.Shell;"
+        f"$s = $wsh.CreateShortcut('{str(link_path)}');"
+        f"$s.TargetPath = '{str(exe_path)}';"
+        f"$s.WorkingDirectory = '{str(exe_path.parent)}';"
+        f"$s.IconLocation = '{str(exe_path)}';"
+        "$s.Description = 'JesnZIP tray agent'; $s.Save();"
+    )
+    info('Creating Start Menu shortcut (via PowerShell COM)')
+    run(['powershell', '-NoProfile', '-Command', ps_cmd], check=False)
+    info(f'Start Menu shortcut attempted at: {link_path}')
+
+
+def download_all_missing() -> None:
+    # Ensure required files are present (download any missing ones concurrently;
+    # the fetches are network-bound and independent)
+    todo = [(url, path, required) for url, path, required in (
+        (SCRIPT_URL, ROOT / SCRIPT_NAME, True),
+        (ICON_URL, ROOT / ICON_NAME, False),
+        (SETTINGS_URL, ROOT / SETTINGS_NAME, False),
+    ) if not path.exists()]
+    if todo:
+        def fetch(url, path, required):
+            try:
+                cached_download(url, path)
+            except Exception:
+                if required:
+                    raise
+                info(f'{path.name} not available; continuing without it')
+
+        with ThreadPoolExecutor(max_workers=4) as ex:
+            for fut in [ex.submit(fetch, *t) for t in todo]:
+                fut.result()
+
+
+async def main() -> None:
+    os.chdir(str(ROOT))
+    info(f'Running installer.py in: {ROOT}')
+
+    # Asset downloads and venv creation don't depend on each other, so overlap
+    # them: the fetch latency hides behind venv setup (or vice versa).
+    downloads = asyncio.create_task(asyncio.to_thread(download_all_missing))
+    venv_python = await asyncio.to_thread(ensure_venv)
+    await downloads
+    # Pre-resolved command prefix reused by every pip invocation below
+    pip = [str(venv_python), '-m', 'pip']
+    install_requirements(pip)
+    uninstall_blacklist(pip)
+
+    exe = run_pyinstaller(venv_python, ROOT / SCRIPT_NAME, ROOT / ICON_NAME)
+    zip_path = create_zip(exe)
+    info(f'Built and zipped: {zip_path}')
+
+    create_shortcut = input('Create Start Menu shortcut? (Y/n) [Default: Y] ').strip()
+    if create_shortcut == '' or create_shortcut.lower().startswith('y'):
+        create_start_menu_shortcut(exe)
+    else:
+        info('Skipping Start Menu shortcut creation as requested.')
+
+    login_prompt = input('Do you want to login with a session key now? (y/N) [Default: N] ').strip()
+    if login_prompt.lower().startswith('y'):
+        info('Launching JesnZIP-tray for session key login...')
+        run([str(exe), '--session-prompt'], check=False)
+    else:
+        info('Skipping session key login prompt as requested.')
+
+    try:
+        if os.name == 'nt':
+            try:
+                # ShellExecuteW via os.startfile: no subprocess pipe plumbing
+                os.startfile(str(exe), cwd=str(exe.parent))  # cwd arg needs 3.10+
+            except TypeError:
+                ctypes.windll.shell32.ShellExecuteW(None, 'open', str(exe), None, str(exe.parent), 1)
+        else:
+            subprocess.Popen([str(exe)], cwd=str(exe.parent), close_fds=True)
+    except Exception as e:
+        info(f'Failed to launch JesnZIP-tray: {e}')
+    
+    info('Installer completed successfully :3')
+    sys.exit(0)
+
+
+if __name__ == '__main__':
+    try:
+        if os.name == 'nt':
+            # Proactor loop so asyncio subprocess support works on Windows
+            asyncio.set_event_loop_policy(asyncio.WindowsProactorEventLoopPolicy())
+        asyncio.run(main())
+    except Exception as e:
+        print('ERROR:', e)
+        sys.exit(1)